@@ -47,11 +47,23 @@ You'll probably need this when calculating a transaction id.
 """
 import sys
 assert sys.version_info >= (3, 6)
+import os
 import hashlib
+import itertools
+import math
+import struct
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import dill as serializer
+try:
+    import blake3
+except ImportError:
+    blake3 = None
 
 class Output:
     """ This models a transaction output """
+    __slots__ = ('constraint', 'amount')
+
     def __init__(self, constraint = None, amount = 0):
         """ constraint is a function that takes 1 argument which is a list of 
             objects and returns True if the output can be spent.  For example:
@@ -78,6 +90,8 @@ class Output:
 
 class Input:
     """ This models an input (what is being spent) to a blockchain transaction """
+    __slots__ = ('txHash', 'txIdx', 'satisfier')
+
     def __init__(self, txHash, txIdx, satisfier):
         """ This input references a prior output by txHash and txIdx.
             txHash is therefore the prior transaction hash
@@ -95,8 +109,21 @@ class Input:
         return self.satisfier
     
 
+def _fieldBytes(value, width, signed = False):
+    """ Encode an int field for hashing as a fixed width big endian integer.
+        Anything else (a float, a negative or too large int, ...) falls back to dill.
+        The leading tag byte keeps the two encodings apart. """
+    if type(value) is int:
+        try:
+            return b"i" + value.to_bytes(width, "big", signed=signed)
+        except OverflowError:
+            pass
+    return b"p" + serializer.dumps(value)
+
 class Transaction:
     """ This is a blockchain transaction """
+    __slots__ = ('inputs', 'outputs', 'data', '_hash_cache')
+
     def __init__(self, inputs=None, outputs=None, data = None):
         """ Initialize a transaction from the provided parameters.
             inputs is a list of Input objects that refer to unspent outputs.
@@ -107,11 +134,53 @@ class Transaction:
         self.inputs = inputs if inputs is not None else []
         self.outputs = outputs if outputs is not None else []
         self.data = data if data is not None else b''
+        self._hash_cache = None
+
+    def _hashKey(self):
+        """ Fingerprint of everything the hash covers: every Input and Output object with its
+            reference, satisfier, amount and constraint, plus data.  Adding, removing or replacing
+            elements or reassigning any of those fields changes it.  Edits made inside a satisfier
+            object (e.g. appending to the list) are not seen. """
+        data = self.data
+        return (tuple([(i, i.txHash, i.txIdx, i.satisfier) for i in self.inputs]),
+                tuple([(o, o.amount, o.constraint) for o in self.outputs]),
+                bytes(data) if isinstance(data, bytearray) else data)
 
     def getHash(self):
         """Return this transaction's probabilistically unique identifier as a big-endian integer"""
-        tx_data = serializer.dumps((self.inputs, self.outputs, self.data))
-        return int.from_bytes(hashlib.sha256(tx_data).digest(), "big")
+        key = self._hashKey()
+        if self._hash_cache is None or self._hash_cache[0] != key:
+            self._calcHash(key)
+        return self._hash_cache[2]
+
+    def getHashBytes(self):
+        """Return this transaction's hash as 32 raw bytes (the big-endian form of getHash())"""
+        key = self._hashKey()
+        if self._hash_cache is None or self._hash_cache[0] != key:
+            self._calcHash(key)
+        return self._hash_cache[1]
+
+    def _calcHash(self, key):
+        """ Hash the transaction and cache (key, digest bytes, digest as an integer) """
+        # Only the scripts (and unusual field values) need dill, the rest is written as raw bytes
+        h = hashlib.sha256()
+        h.update(len(self.inputs).to_bytes(4, "big"))
+        for i_obj in self.inputs:
+            h.update(_fieldBytes(i_obj.txHash, 32))
+            h.update(_fieldBytes(i_obj.txIdx, 4))
+            h.update(serializer.dumps(i_obj.satisfier))
+        h.update(len(self.outputs).to_bytes(4, "big"))
+        for o in self.outputs:
+            h.update(_fieldBytes(o.amount, 8, signed=True))
+            h.update(serializer.dumps(o.constraint))
+        data = self.data
+        if isinstance(data, (bytes, bytearray)):
+            h.update(b"b" + data)
+        else:
+            h.update(b"p" + serializer.dumps(data))
+
+        digest = h.digest()
+        self._hash_cache = (key, digest, int.from_bytes(digest, "big"))
 
     def getInputs(self):
         """ return a list of all inputs that are being spent """
@@ -123,6 +192,13 @@ class Transaction:
             return self.outputs[n]
         return None  
 
+    def _outputTotal(self):
+        """ Return the sum of the output amounts """
+        toutput = 0
+        for o in self.outputs:
+            toutput += o.amount
+        return toutput
+
     def validateMint(self, maxCoinsToCreate):
         """ Validate a mint (coin creation) transaction.
             A coin creation transaction should have no inputs,
@@ -131,29 +207,114 @@ class Transaction:
         if self.inputs:
             return False
         
-        output = sum(output.amount for output in self.outputs)
-        return output <= maxCoinsToCreate
+        return self._outputTotal() <= maxCoinsToCreate
 
     def validate(self, unspentOutputDict):
         """ Validate this transaction given a dictionary of unspent transaction outputs.
             unspentOutputDict is a dictionary of items of the following format: { (txHash, offset) : Output }
         """
-        tinput = 0
-        toutput = sum(o.amount for o in self.outputs)
+        return self.spendInputs(UtxoView(unspentOutputDict))
 
+    def spendInputs(self, utxo):
+        """ Validate this transaction's inputs against utxo, removing every output it spends.
+            Each input pops its output, so an output listed twice is only spendable once.
+            Returns True if the transaction is valid; utxo may be partially updated if not.
+        """
+        tinput = 0
         for i_obj in self.inputs:
-            ref = i_obj.get_reference()
-
-            if ref not in unspentOutputDict:
+            o_spent = utxo.pop((i_obj.txHash, i_obj.txIdx), None)
+            if o_spent is None or not o_spent.can_spend(i_obj.satisfier):
                 return False
+            tinput += o_spent.amount
 
-            o_spent = unspentOutputDict[ref]
-            if not o_spent.can_spend(i_obj.get_satisfier()):
-                return False
+        return tinput >= self._outputTotal()
 
-            tinput += o_spent.amount
 
-        return tinput >= toutput
+# hashlib only releases the GIL for inputs of 2KB or more, so 64 byte pair hashes
+# can only run concurrently on a free-threaded interpreter
+_HASH_WORKERS = (os.cpu_count() or 1) if not getattr(sys, "_is_gil_enabled", lambda: True)() else 1
+_PARALLEL_MIN_PAIRS = 2048
+_hash_pool = None
+
+def _sha256_pairs(view, start, stop):
+    """ Hash pairs start..stop-1 of view, returning the digests concatenated """
+    sha256 = hashlib.sha256
+    return b"".join([sha256(view[i:i + 64]).digest() for i in range(start * 64, stop * 64, 64)])
+
+def _sha256_pair_batch(buf, n_pairs):
+    """ Hash n_pairs consecutive 64 byte (left || right) pairs from buf.
+        Returns the n_pairs 32 byte digests concatenated, in order.
+        This is the only place merkle pairs are hashed, so a faster
+        (native, multi-lane) sha256 backend can be dropped in here.
+        Every input is exactly 64 bytes, so such a backend can use a constant
+        second (padding) block with a precomputed message schedule.
+    """
+    global _hash_pool
+    # Slicing a memoryview does not copy, so each pair is hashed in place
+    view = memoryview(buf)
+    if n_pairs < _PARALLEL_MIN_PAIRS or _HASH_WORKERS == 1:
+        return _sha256_pairs(view, 0, n_pairs)
+
+    # Pairs in a level are independent, so split big levels into one chunk per core
+    if _hash_pool is None:
+        _hash_pool = ThreadPoolExecutor(_HASH_WORKERS)
+    chunk = -(-n_pairs // _HASH_WORKERS)
+    starts = range(0, n_pairs, chunk)
+    return b"".join(_hash_pool.map(lambda start: _sha256_pairs(view, start, min(start + chunk, n_pairs)), starts))
+
+
+class UtxoView:
+    """ A copy-on-write view of a UTXO set: { (txHash, offset) : Output }
+
+        Only the outputs added and removed on top of the parent set are stored, the parent
+        is never modified.  added and removed ({ ref : Output }, holding the removed outputs so
+        the change can be undone) together form the delta of the view.
+    """
+    def __init__(self, parent = None):
+        self.parent = parent if parent is not None else {}
+        self.added = {}
+        self.removed = {}
+
+    def get(self, ref, default = None):
+        if ref in self.added:
+            return self.added[ref]
+        if ref in self.removed:
+            return default
+        return self.parent.get(ref, default)
+
+    def __contains__(self, ref):
+        return self.get(ref) is not None
+
+    def __getitem__(self, ref):
+        output = self.get(ref)
+        if output is None:
+            raise KeyError(ref)
+        return output
+
+    def __setitem__(self, ref, output):
+        # Overwriting an output of the parent (e.g. a repeated coinbase) must keep the
+        # parent's Output in removed, or undoing this delta would lose it
+        if ref not in self.added and ref not in self.removed:
+            p_output = self.parent.get(ref)
+            if p_output is not None:
+                self.removed[ref] = p_output
+        self.added[ref] = output
+
+    def __delitem__(self, ref):
+        if self.pop(ref) is None:
+            raise KeyError(ref)
+
+    def pop(self, ref, default = None):
+        """ Remove ref from the view and return its Output, or default if it isn't there """
+        output = self.get(ref)
+        if output is None:
+            return default
+        self.added.pop(ref, None)
+        if ref not in self.removed:
+            p_output = self.parent.get(ref)
+            if p_output is not None:
+                self.removed[ref] = p_output
+        return output
 
 
 class HashableMerkleTree:
@@ -174,28 +335,44 @@ class HashableMerkleTree:
 
     def __init__(self, hashableList = None):
         self.leaves = hashableList if hashableList else []
+        self._leaf_hashes = None
+
+    def invalidate(self):
+        """ Forget the cached leaf hashes.  Call this after changing the leaves in any way
+            (adding, removing, replacing or editing one); nothing else clears the cache. """
+        self._leaf_hashes = None
 
     def calcMerkleRoot(self):
         """ Calculate the merkle root of this tree."""
         if not self.leaves:
             return 0  
 
-        cur_level = [ob.getHash() for ob in self.leaves]
-
-        while len(cur_level) > 1:
-            n_level = []
-
-            for i in range(0, len(cur_level), 2):
-                left = cur_level[i]
-                right = cur_level[i + 1] if i + 1 < len(cur_level) else 0
-
-                combined = hashlib.sha256((left.to_bytes(32, "big") +
-                                                right.to_bytes(32, "big"))).digest()
-                n_level.append(int.from_bytes(combined, "big"))
-
-            cur_level = n_level
-
-        return cur_level[0]
+        # Each level is one contiguous buffer of 32 byte big endian hashes.
+        # The leaf level is kept until invalidate() so that the leaves are only hashed once.
+        if self._leaf_hashes is None:
+            n = len(self.leaves)
+            leaf_bytes = bytearray(n * 32)
+            for i, ob in enumerate(self.leaves):
+                # Leaves that can hand over their raw digest skip the int round trip
+                get_bytes = getattr(ob, "getHashBytes", None)
+                if get_bytes is not None:
+                    leaf_bytes[i * 32:(i + 1) * 32] = get_bytes()
+                else:
+                    leaf_bytes[i * 32:(i + 1) * 32] = ob.getHash().to_bytes(32, "big")
+            self._leaf_hashes = bytes(leaf_bytes)
+        level_bytes = self._leaf_hashes
+        n = len(level_bytes) // 32
+
+        while n > 1:
+            # Pad an odd level with a zero hash up front so every element has a partner
+            if n & 1:
+                level_bytes = level_bytes + bytes(32)
+                n += 1
+
+            level_bytes = _sha256_pair_batch(level_bytes, n // 2)
+            n //= 2
+
+        return int.from_bytes(level_bytes, "big")
 
 
 class BlockContents:
@@ -205,27 +382,64 @@ class BlockContents:
     """
     def __init__(self):
         self.data = HashableMerkleTree() 
+        self._root = None
 
     def setData(self, d):
         self.data = HashableMerkleTree(d)
+        self._root = None
 
     def getData(self):
         return self.data
 
+    def invalidate(self):
+        """ Forget the cached merkle root and leaf hashes.  Call this after editing getData().leaves. """
+        self.data.invalidate()
+        self._root = None
+
     def calcMerkleRoot(self):
-        return self.data.calcMerkleRoot()
+        """ Return the merkle root, computed on first use and cached until setData() or invalidate() """
+        if self._root is None:
+            self._root = self.data.calcMerkleRoot()
+        return self._root
+
+_NONCE = struct.Struct(">Q")
+
+def _mine(prefix, target, start_nonce):
+    """ Return the first nonce >= start_nonce for which sha256(prefix + nonce) is below target.
+        The nonce is appended as 8 big endian bytes.
+        Only the nonce changes between trials, so the prefix is hashed once and every
+        trial continues from a copy of that sha256 state.
+    """
+    # Every sha256 digest is below a target this large
+    if target >= 1 << 256:
+        return start_nonce
+
+    # Digests are integers, so digest < target exactly when digest < ceil(target) (for float targets).
+    # Both are then 32 big endian bytes, so comparing the bytes compares the integers
+    target_bytes = math.ceil(target).to_bytes(32, "big")
+    copy = hashlib.sha256(prefix).copy
+    pack = _NONCE.pack
+    for nonce in itertools.count(start_nonce):
+        h = copy()
+        h.update(pack(nonce))
+        if h.digest() < target_bytes:
+            return nonce
 
 class Block:
     """ This class should represent a blockchain block.
         It should have the normal fields needed in a block and also an instance of "BlockContents"
         where we will store a merkle tree of transactions.
     """
+    __slots__ = ('contents', 'priorBlockHash', 'target', 'nonce', 'utxo_delta', 'height', 'cumulative_work')
+
     def __init__(self):
         self.contents = BlockContents()
         self.priorBlockHash = None       
         self.target = None                
         self.nonce = 0                    
-        self.utxo_set = {}                
+        self.utxo_delta = ({}, {})
+        self.height = None
+        self.cumulative_work = 0
 
     def getContents(self):
         """ Return the Block content (a BlockContents object)"""
@@ -243,12 +457,30 @@ class Block:
         """ Return the difficulty target of this block """
         return self.target
 
-    def getHash(self):
-        """ Calculate the hash of this block. Return as an integer """
-        header = (str(self.priorBlockHash) + str(self.contents.calcMerkleRoot()) + 
-                  str(self.target) + str(self.nonce)).encode()
+    def getHash(self, use_fast_hash = False):
+        """ Calculate the hash of this block. Return as an integer
+
+            use_fast_hash hashes the header with blake3 (or 256 bit blake2b if blake3 is not
+            installed) instead of sha256.  That hash is NOT the block hash used for proof-of-work
+            and validation, so only use it for local, non-consensus purposes.
+        """
+        header = self.getHeaderPrefix() + self.nonce.to_bytes(8, "big")
+        if use_fast_hash:
+            if blake3 is not None:
+                return int.from_bytes(blake3.blake3(header).digest(), "big")
+            return int.from_bytes(hashlib.blake2b(header, digest_size=32).digest(), "big")
         return int.from_bytes(hashlib.sha256(header).digest(), "big")
 
+    def getHeaderPrefix(self):
+        """ Return the block header without the nonce: the prior block hash and merkle root
+            as 32 byte big endian integers (a missing value is all zeros), then the target.
+            The target is encoded like a transaction field (see _fieldBytes), so targets that
+            are not 256 bit ints, e.g. genesisTarget / 2 or 2**256, still hash. """
+        prior = self.priorBlockHash if self.priorBlockHash is not None else 0
+        target = self.target if self.target is not None else 0
+        return (prior.to_bytes(32, "big") + self.contents.calcMerkleRoot().to_bytes(32, "big") +
+                _fieldBytes(target, 32))
+
     def setPriorBlockHash(self, priorHash):
         """ Assign the parent block hash """
         self.priorBlockHash = priorHash
@@ -260,8 +492,8 @@ class Block:
     def mine(self, tgt):
         """Update the block header to the passed target (tgt) and then search for a nonce which produces a block whose hash is less than the target, "solving" the block"""
         self.target = tgt
-        while self.getHash() >= tgt:
-            self.nonce += 1
+
+        self.nonce = _mine(self.getHeaderPrefix(), tgt, self.nonce)
 
     def validate(self, unspentOutputs, maxMint):
         """ Given a dictionary of unspent outputs, and the maximum amount of
@@ -276,11 +508,17 @@ class Block:
             block applied, for your own use when implementing other APIs.
 
             461: you can ignore the unspentOutputs field (just pass {} when calling this function)
+
+            A valid block returns its UTXO delta: (added, removed), both { (txHash, offset) : Output }.
+            unspentOutputs itself is not modified.
         """
+        # Never trust the cached merkle root here: recompute it from the transactions
+        # (whose own hashes are re-checked against their fields) before checking the POW
+        self.contents.invalidate()
         if self.getHash() >= self.target:
             return None
 
-        n_utxo = unspentOutputs.copy()
+        n_utxo = UtxoView(unspentOutputs)
         transactions = self.contents.getData().leaves  
         c_found = False
 
@@ -290,21 +528,17 @@ class Block:
                     return None
                 c_found = True
             else:
-                if not tx.validate(n_utxo):
+                if not tx.spendInputs(n_utxo):
                     return None
 
+            tx_hash = tx.getHash()
             for i, output in enumerate(tx.outputs):
-                n_utxo[(tx.getHash(), i)] = output
-
-            for i_obj in tx.getInputs():
-                ref = i_obj.get_reference()
-                if ref in n_utxo:
-                    del n_utxo[ref]
+                n_utxo[(tx_hash, i)] = output
 
         if len(transactions) > 0 and not c_found:
             return None
 
-        return n_utxo
+        return (n_utxo.added, n_utxo.removed)
 
 class Blockchain(object):
 
@@ -314,29 +548,23 @@ class Blockchain(object):
             maxMintCoinsPerTx is a consensus parameter -- don't let any block into the chain that creates more coins than this!
         """
         self.blocks = {}  
-        self.height_blocks = {}  
+        self.height_blocks = defaultdict(list)
         self.maxMintCoinsPerTx = maxMintCoinsPerTx
         self.genesisTarget = genesisTarget
 
-        self.genesis_utxo_set = {}
-        
         genesis_block = Block()
         genesis_block.setTarget(genesisTarget)
         genesis_block.mine(genesisTarget)
-        genesis_block.utxo_set = self.genesis_utxo_set  
         self.add_block(genesis_block)
 
+        # Blocks only keep their UTXO delta.  The full set is kept for one block at a time
+        # (normally the tip) and moved along the deltas when another fork is needed.
+        self.tip_utxo = {}
+        self._tip_utxo_block = genesis_block
+
     def getTip(self):
         """ Return the block at the tip (end) of the blockchain fork that has the largest amount of work"""
-        m_work = -1
-        tip_block = None
-
-        for blk in self.blocks.values():
-            blk_work = self.getCumulativeWork(blk.getHash())
-            if blk_work and blk_work > m_work:
-                m_work = blk_work
-                tip_block = blk
-        return tip_block
+        return self._tip
 
     def getWork(self, target):
         """Get the "work" needed for this target.  Work is the ratio of the genesis target to the passed target"""
@@ -347,13 +575,7 @@ class Blockchain(object):
         blk = self.blocks.get(blkHash)
         if not blk:
             return None
-
-        cumul_work = 0
-        while blk:
-            cumul_work += self.getWork(blk.getTarget())
-            blk = self.blocks.get(blk.getPriorBlockHash())
-        
-        return cumul_work
+        return blk.cumulative_work
 
     def getBlocksAtHeight(self, height):
         """Return an array of all blocks in the blockchain at the passed height (including all forks)"""
@@ -374,20 +596,22 @@ class Blockchain(object):
             return False
 
         p_block = self.blocks[block.getPriorBlockHash()]
-        p_set = p_block.utxo_set.copy() if p_block else self.genesis_utxo_set
+        p_set = self._moveTipUtxo(p_block)
 
-        n_set = block.validate(p_set, self.maxMintCoinsPerTx)
-        if n_set is None:
+        delta = block.validate(p_set, self.maxMintCoinsPerTx)
+        if delta is None:
             return False  
         
         blk_hash = block.getHash()
         self.blocks[blk_hash] = block
 
-        block.utxo_set = n_set
+        block.utxo_delta = delta
         block.height = p_block.height + 1 if p_block else 0
+        block.cumulative_work = p_block.cumulative_work + self.getWork(block.getTarget())
+        if block.cumulative_work > self._tip.cumulative_work:
+            self._tip = block
+            self._moveTipUtxo(block)
 
-        if block.height not in self.height_blocks:
-            self.height_blocks[block.height] = []
         self.height_blocks[block.height].append(block)
 
         return True
@@ -402,7 +626,41 @@ class Blockchain(object):
         block_hash = block.getHash()
         self.blocks[block_hash] = block
         block.height = 0  
-        self.height_blocks[0] = [block] 
+        block.cumulative_work = self.getWork(block.getTarget())
+        self.height_blocks[0].append(block)
+        self._tip = block
+
+    def _moveTipUtxo(self, block):
+        """ Make self.tip_utxo the UTXO set as of block and return it.
+            Walks back from the current UTXO block to the common ancestor undoing deltas,
+            then forward down block's fork applying them.
+        """
+        cur = self._tip_utxo_block
+        dst = block
+        undo = []
+        redo = []
+        while cur is not dst:
+            if cur.height >= dst.height:
+                undo.append(cur)
+                cur = self.blocks[cur.getPriorBlockHash()]
+            else:
+                redo.append(dst)
+                dst = self.blocks[dst.getPriorBlockHash()]
+
+        utxo = self.tip_utxo
+        for blk in undo:
+            added, removed = blk.utxo_delta
+            for ref in added:
+                del utxo[ref]
+            utxo.update(removed)
+        for blk in reversed(redo):
+            added, removed = blk.utxo_delta
+            for ref in removed:
+                del utxo[ref]
+            utxo.update(added)
+
+        self._tip_utxo_block = block
+        return utxo
 
 
 # --------------------------------------------
@@ -420,11 +678,39 @@ def Test():
     h2 = b2.getHash()
     assert h2 < h1
 
+    # A float target (e.g. a work ratio of the genesis target) still gives a block hash
+    b4 = Block()
+    b4.setTarget(int("F"*64,16) / 2)
+    b4.getHash()
+    b4.mine(int("F"*64,16) / 2)
+    assert b4.getHash() < int("F"*64,16) / 2
+
+    # Targets beyond the 256 bit hash range are met by any nonce
+    b3 = Block()
+    b3.mine(2**256)
+    assert b3.getHash() < 2**256
+    Blockchain(2**256, 10)
+
     t0 = Transaction(None, [Output(lambda x: True, 100)])
+    # Transactions with unusual field values still hash
+    Transaction([Input("not an int", -1, [])], [Output(None, 1.5), Output(None, 2**63)]).getHash()
+
+    # The cached transaction hash follows changes to the outputs
+    t1 = Transaction(None, [Output(None, 10)])
+    h = t1.getHash()
+    t1.outputs[0].amount = 11
+    assert t1.getHash() != h
+    h = t1.getHash()
+    t1.outputs[0] = Output(None, 12)
+    assert t1.getHash() != h
+
     # Negative test: minted too many coins
     assert t0.validateMint(50) == False, "1 output: tx minted too many coins"
     # Positive test: minted the right number of coins
     assert t0.validateMint(100) == True, "1 output: tx minted the right number of coins"
+    # Outputs changed after construction are still counted
+    t0.outputs.append(Output(None, 1000))
+    assert t0.validateMint(100) == False, "2 outputs: tx minted too many coins"
 
     class GivesHash:
         def __init__(self, hash):
@@ -436,4 +722,55 @@ def Test():
 
     assert HashableMerkleTree([GivesHash(x) for x in [106874969902263813231722716312951672277654786095989753245644957127312510061509, 66221123338548294768926909213040317907064779196821799240800307624498097778386, 98188062817386391176748233602659695679763360599522475501622752979264247167302]]).calcMerkleRoot().to_bytes(32,"big").hex() == "ea670d796aa1f950025c4d9e7caf6b92a5c56ebeb37b95b072ca92bc99011c20"
 
+    # Editing a block's leaves in place needs invalidate() to refresh the block hash
+    blk = Block()
+    blk.setContents([Transaction(None, [Output(None, 1)])])
+    h = blk.getHash()
+    blk.getContents().getData().leaves.append(Transaction(None, [Output(None, 2)]))
+    blk.getContents().invalidate()
+    assert blk.getHash() != h
+
+    # Changing a leaf takes effect once the tree is invalidated
+    tree = HashableMerkleTree([GivesHash(1), GivesHash(2)])
+    r = tree.calcMerkleRoot()
+    tree.leaves[1] = GivesHash(3)
+    tree.invalidate()
+    assert tree.calcMerkleRoot() != r
+
+    # A block whose transaction was altered after mining no longer validates
+    blk = Block()
+    tx = Transaction(None, [Output(None, 1)])
+    blk.setContents([tx])
+    blk.mine(2**250)
+    assert blk.validate({}, 10) is not None
+    h = blk.getHash()
+    tx.data = b"tampered"
+    valid = blk.validate({}, 10) is not None
+    assert blk.getHash() != h, "validate must see the altered transaction"
+    assert valid == (blk.getHash() < 2**250)
+
+    # Reorg test: b repeats a's coinbase, so it overwrites the same UTXO refs.
+    # Switching to fork c (off a) must bring a's coinbase output back so c can spend it.
+    tgt = int("F"*64,16)
+    bc = Blockchain(tgt, 100)
+    cb = Transaction(None, [Output(None, 50)])
+    a = Block(); a.setPriorBlockHash(bc.getTip().getHash()); a.setContents([cb]); a.mine(tgt)
+    assert bc.extend(a)
+    b = Block(); b.setPriorBlockHash(a.getHash()); b.setContents([cb]); b.mine(tgt)
+    assert bc.extend(b)
+    c = Block(); c.setPriorBlockHash(a.getHash())
+    c.setContents([Transaction(None, [Output(None, 1)], b"c"), Transaction([Input(cb.getHash(), 0, [])], [Output(None, 50)])])
+    c.mine(tgt)
+    assert bc.extend(c), "fork off a can spend a's coinbase after b overwrote it"
+
+    # Spending the same output twice in one transaction is invalid, on its own and in a block
+    utxo = {(cb.getHash(), 0): cb.getOutput(0)}
+    dbl = Transaction([Input(cb.getHash(), 0, []), Input(cb.getHash(), 0, [])], [Output(None, 100)])
+    assert dbl.validate(utxo) == False, "double spend within a tx"
+    assert (cb.getHash(), 0) in utxo, "validate() must not modify the passed dict"
+    d = Block(); d.setPriorBlockHash(a.getHash())
+    d.setContents([Transaction(None, [Output(None, 1)], b"d"), dbl])
+    d.mine(tgt)
+    assert not bc.extend(d)
+
     print ("yay local tests passed")
\ No newline at end of file